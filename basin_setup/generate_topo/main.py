@@ -1,19 +1,31 @@
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import geopandas as gpd
+import numpy as np
+import rasterio
 import rioxarray
 import xarray as xr
+from rasterio import Affine
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.warp import reproject
+from shapely.geometry import box
 
 from basin_setup import __version__
 from basin_setup.generate_topo import vegetation
 from basin_setup.generate_topo.shapefile import Shapefile
-from basin_setup.utils import config, domain_extent, gdal
+from basin_setup.utils import config, domain_extent, gdal, raster
 from basin_setup.utils.logger import BasinSetupLogger
 
 
 class GenerateTopo():
 
+    # Cells in x and y for each chunk of the images in the topo.nc
+    NC_CHUNK_SIZE = 128
+
     def __init__(self, config_file):
 
         self.ucfg, self.configFile = config.read(config_file)
@@ -30,8 +42,15 @@ class GenerateTopo():
         os.makedirs(self.temp_dir, exist_ok=True)
 
         self.cell_size = self.config['cell_size']
+        self.chunk_size = self.config['chunk_size']
         self.debug = self.config['leave_intermediate_files']
 
+        # Threads for each warp, None uses all the CPUs
+        self.num_threads = None
+
+        # Set from the config or basin outline in set_extents
+        self.extents = None
+
         self.images = {}
 
     def run(self):
@@ -40,9 +59,27 @@ class GenerateTopo():
 
         self.set_extents()
         self.load_basin_shapefiles()
-        self.load_dem()
-        self.load_vegetation()
+
+        # The DEM and vegetation are reprojected independently unless the
+        # empty vegetation is based on the DEM. The DEM and the vegetation
+        # type and height are then warped at the same time, so the CPUs are
+        # split between the three warps.
+        if self.config['parallel_load'] and \
+                self.config['vegetation_dataset'] is not None:
+            self.num_threads = max(1, (os.cpu_count() or 1) // 3)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [
+                    executor.submit(self.load_dem),
+                    executor.submit(self.load_vegetation)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            self.load_dem()
+            self.load_vegetation()
+
         self.create_netcdf()
+        self.remove_intermediate_files()
 
     def set_extents(self):
         """Set the extents to clip the rasters to. This will either use
@@ -82,17 +119,28 @@ class GenerateTopo():
         """
 
         self._logger.info("Loading shapefiles...")
+
+        # Only the features within the domain are needed for the masks
+        bbox = None
+        if self.extents is not None:
+            bbox = tuple(self.extents)
+
         self.basin_shapefiles = [
-            Shapefile(self.config['basin_shapefile'])
+            Shapefile(self.config['basin_shapefile'], bbox=bbox)
         ]
 
         # The project CRS is based on the basin shapefile
         self.crs = self.basin_shapefiles[0].crs
 
-        # Add the sub basin files
+        # Add the sub basin files, in the project CRS
         if self.config['sub_basin_files'] is not None:
+            if bbox is not None:
+                bbox = gpd.GeoSeries([box(*bbox)], crs=self.crs)
+
             for sub_basin_file in self.config['sub_basin_files']:
-                self.basin_shapefiles += Shapefile(sub_basin_file)
+                sub_basin = Shapefile(sub_basin_file, bbox=bbox)
+                sub_basin.reproject(self.crs)
+                self.basin_shapefiles.append(sub_basin)
 
     def load_dem(self):
         """Reproject and crop the DEM file to a new image
@@ -100,6 +148,51 @@ class GenerateTopo():
 
         self._logger.info('Loading DEM dataset and cropping')
 
+        # A DEM already on the domain grid only needs to be cropped
+        aligned = raster.aligned_window(
+            self.config['dem_file'], self.crs, self.extents, self.cell_size)
+
+        if aligned is not None and aligned[1] == 1:
+            self.dem = self.read_dem_window(aligned[0])
+        elif self.config['warp_in_memory']:
+            self.dem = self.warp_dem_in_memory()
+        else:
+            self.dem = self.warp_dem()
+
+        self.dem = self.dem.squeeze('band')
+        self.dem = self.dem.drop_vars('band')
+        self.dem.attrs = {
+            'long_name': 'dem'
+        }
+
+    def read_dem_window(self, window):
+        """Crop the DEM by lazily reading the window of the DEM for the
+        domain, no clipped image is written.
+
+        Args:
+            window (rasterio.windows.Window): window of the domain in the DEM
+
+        Returns:
+            xr.DataArray: lazily loaded cropped DEM
+        """
+
+        self._logger.debug('DEM is on the domain grid, reading the window')
+
+        dem = rioxarray.open_rasterio(
+            self.config['dem_file'],
+            default_name='dem',
+            chunks=raster.block_chunks(
+                self.config['dem_file'], self.chunk_size)
+        )
+        return dem.rio.isel_window(window)
+
+    def warp_dem(self):
+        """Reproject and crop the DEM to a clipped image with gdalwarp
+
+        Returns:
+            xr.DataArray: lazily loaded clipped DEM
+        """
+
         self.images['dem'] = os.path.join(self.temp_dir, 'clipped_dem.tif')
 
         gdal.gdalwarp(
@@ -109,19 +202,54 @@ class GenerateTopo():
             self.extents,
             self.cell_size,
             resample='bilinear',
+            warp_memory=self.config['warp_memory'],
+            num_threads=self.num_threads,
             logger=self._logger
         )
 
-        self.dem = rioxarray.open_rasterio(
-            self.images['dem'], default_name='dem')
-        self.dem = self.dem.squeeze('band')
-        self.dem = self.dem.drop_vars('band')
-        self.dem.attrs = {
-            'long_name': 'dem'
-        }
+        # lazily load the DEM, the image is read when the topo is written
+        return rioxarray.open_rasterio(
+            self.images['dem'],
+            default_name='dem',
+            chunks=raster.block_chunks(self.images['dem'], self.chunk_size)
+        )
 
-        if not self.debug:
-            os.remove(self.images['dem'])
+    def warp_dem_in_memory(self):
+        """Reproject and crop the DEM into an in memory GDAL image, no
+        clipped image is written to the temp folder.
+
+        Returns:
+            xr.DataArray: lazily loaded clipped DEM
+        """
+
+        left, bottom, right, top = self.extents
+
+        with rasterio.open(self.config['dem_file']) as src:
+            self._dem_memory_file = MemoryFile()
+            with self._dem_memory_file.open(
+                driver='GTiff',
+                width=int(round((right - left) / self.cell_size)),
+                height=int(round((top - bottom) / self.cell_size)),
+                count=1,
+                dtype=src.dtypes[0],
+                crs=self.crs,
+                transform=Affine(
+                    self.cell_size, 0, left, 0, -self.cell_size, top),
+                nodata=src.nodata
+            ) as dst:
+                reproject(
+                    rasterio.band(src, 1),
+                    rasterio.band(dst, 1),
+                    resampling=Resampling.bilinear,
+                    num_threads=self.num_threads or os.cpu_count() or 1
+                )
+
+        image = self._dem_memory_file.name
+        return rioxarray.open_rasterio(
+            image,
+            default_name='dem',
+            chunks=raster.block_chunks(image, self.chunk_size)
+        )
 
     def load_vegetation(self):
         """Load the vegetation images and parse based on which dataset
@@ -140,7 +268,7 @@ class GenerateTopo():
             elif self.config['vegetation_dataset'] == 'landfire_2.0.0':
                 veg = vegetation.Landfire200(self.config)
 
-            veg.reproject(self.extents, self.crs)
+            veg.reproject(self.extents, self.crs, self.num_threads)
             veg.load_clipped_images()
             veg.calculate_tau_and_k()
             veg.calculate_height()
@@ -214,20 +342,50 @@ class GenerateTopo():
                             'Watershed Research Center')
         }
 
+        encoding = {
+            "x": {"dtype": "f4"},
+            "y": {"dtype": "f4"},
+            "dem": {"dtype": "f4", "grid_mapping": "projection"},
+            "mask": {"grid_mapping": "projection"},
+            "veg_type": {"dtype": 'u2', "grid_mapping": "projection"},
+            "veg_height": {
+                "dtype": "f4",
+                "_FillValue": np.float32(np.nan),
+                "grid_mapping": "projection"
+            },
+            "veg_tau": {"dtype": "f4", "grid_mapping": "projection"},
+            "veg_k": {"dtype": "f4", "grid_mapping": "projection"},
+        }
+
+        # All the images share the same uncompressed chunks so they are
+        # read one tile at a time
+        chunksizes = (
+            min(self.NC_CHUNK_SIZE, len(output.y)),
+            min(self.NC_CHUNK_SIZE, len(output.x))
+        )
+        for name, image in output.data_vars.items():
+            if image.dims == ('y', 'x'):
+                encoding.setdefault(name, {}).update(
+                    {"chunksizes": chunksizes, "zlib": False})
+
         output_path = os.path.join(self.config['output_folder'], 'topo.nc')
         output.to_netcdf(
             output_path,
             format='NETCDF4',
-            encoding={
-                "x": {"dtype": "f4"},
-                "y": {"dtype": "f4"},
-                "dem": {"dtype": "f4", "grid_mapping": "projection"},
-                "mask": {"grid_mapping": "projection"},
-                "veg_type": {"dtype": 'u2', "grid_mapping": "projection"},
-                "veg_height": {"dtype": "f4", "grid_mapping": "projection"},
-                "veg_tau": {"dtype": "f4", "grid_mapping": "projection"},
-                "veg_k": {"dtype": "f4", "grid_mapping": "projection"},
-            }
+            encoding=encoding
         )
 
         self._logger.info('topo.nc file at {}'.format(output_path))
+
+    def remove_intermediate_files(self):
+        """Remove the clipped images and in memory DEM after the topo.nc has
+        been written
+        """
+
+        if hasattr(self, '_dem_memory_file'):
+            self._dem_memory_file.close()
+
+        if not self.debug:
+            if 'dem' in self.images:
+                os.remove(self.images['dem'])
+            self.veg.remove_clipped_images()
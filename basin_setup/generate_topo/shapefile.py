@@ -1,26 +1,53 @@
+from functools import cached_property
+
 import geopandas as gpd
 from rasterio import features
 
 
 class Shapefile():
 
-    def __init__(self, file_name) -> None:
+    def __init__(self, file_name, bbox=None) -> None:
+        """Load the shapefile features
+
+        Args:
+            file_name (str): path to the shapefile
+            bbox (tuple, optional): only load the features that intersect
+                the box [left, bottom, right, top] in the shapefile CRS.
+                Defaults to None, all features.
+        """
         self.file_name = file_name
-        self.polygon = gpd.read_file(self.file_name)
+        self.polygon = gpd.read_file(self.file_name, bbox=bbox)
 
-    @property
+    @cached_property
     def crs(self):
-        """The EPSG code for the shapefile
+        """The EPSG code for the shapefile, parsed once from the polygon CRS
 
         Returns:
             str: EPSG code, ex 'epsg:32611'
         """
         return self.polygon.crs.srs
 
-    @property
+    @cached_property
     def utm_zone_number(self):
         return int(self.polygon.crs.utm_zone.replace('N', ''))
 
+    def reproject(self, crs):
+        """Reproject the features to the CRS if they are not already. All
+        the coordinates are transformed together with a single transformer.
+
+        Args:
+            crs (str): EPSG code, i.e. EPSG:32611
+        """
+
+        if self.polygon.crs == crs:
+            return
+
+        self.polygon = self.polygon.to_crs(crs)
+
+        # clear the cached CRS properties
+        for name in ['crs', 'utm_zone_number']:
+            self.__dict__.pop(name, None)
+
     def mask(self, nx, ny, transform):
         """Create a raster mask from the shapefile using rasterio.features.rasterize
 
@@ -2,13 +2,18 @@ import logging
 import os
 import pathlib
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 import numpy as np
 import pandas as pd
 import rioxarray
 import xarray as xr
 
-from basin_setup.utils import gdal
+from basin_setup.utils import gdal, raster
+
+# match whole numbers and decimals in the Landfire height class names
+HEIGHT_CLASS_REGEX = re.compile(r"(?<!\*)(\d*\.?\d+)(?!\*)")
 
 
 class BaseVegetation():
@@ -36,6 +41,8 @@ class BaseVegetation():
         self.temp_dir = os.path.join(self.config['output_folder'], 'temp')
 
         self.cell_size = self.config['cell_size']
+        self.chunk_size = self.config['chunk_size']
+        self.warp_memory = self.config['warp_memory']
         self.veg_height_resample = self.config[
             'vegetation_height_resample_method'
         ]
@@ -71,36 +78,80 @@ class BaseVegetation():
             'veg_height': os.path.join(self.temp_dir, 'clipped_veg_height.tif')
         }
 
-    def reproject(self, extents, target_crs) -> None:
+    def reproject(self, extents, target_crs, num_threads=None) -> None:
         """reproject vegetation datasets to the desired extents.
 
         Args:
             extents (list): Extents to crop to [left, bottom, right, top]
             target_crs (str): EPSG code, i.e. EPSG:32611
+            num_threads (int, optional): threads for each warp. Defaults to
+                None, the CPUs are split between the two warps.
         """
 
+        if num_threads is None:
+            num_threads = max(1, (os.cpu_count() or 1) // 2)
+
         self._logger.debug(
             'Reprojecting and clipping veg type and height datasets')
 
-        # vegetation type
-        gdal.gdalwarp(
-            self.veg_type_image,
-            self.clipped_images['veg_type'],
-            target_crs,
-            extents,
-            self.cell_size,
-            resample=self.veg_type_resample,
-            logger=self._logger
-        )
+        # The vegetation type and height are independent, warp them at the
+        # same time to overlap the gdalwarp start up
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    self.reproject_image,
+                    self.veg_type_image,
+                    self.clipped_images['veg_type'],
+                    extents,
+                    target_crs,
+                    self.veg_type_resample,
+                    num_threads
+                ),
+                executor.submit(
+                    self.reproject_image,
+                    self.veg_height_image,
+                    self.clipped_images['veg_height'],
+                    extents,
+                    target_crs,
+                    self.veg_height_resample,
+                    num_threads
+                )
+            ]
+
+            # raise any errors from the warps
+            for future in futures:
+                future.result()
+
+    def reproject_image(self, src_image, dst_image, extents, target_crs,
+                        resample, num_threads=None) -> None:
+        """Reproject a vegetation image with gdalwarp. A mode resample onto
+        a grid that lines up with the image is coarsened directly instead.
+
+        Args:
+            src_image (str): source vegetation image
+            dst_image (str): destination file for the clipped image
+            extents (list): Extents to crop to [left, bottom, right, top]
+            target_crs (str): EPSG code, i.e. EPSG:32611
+            resample (str): resampling method
+            num_threads (int, optional): threads for the warp. Defaults to
+                None, all the CPUs.
+        """
+
+        if resample == 'mode' and raster.block_mode(
+                src_image, dst_image, target_crs, extents, self.cell_size):
+            self._logger.debug(
+                'Coarsened {} without reprojecting'.format(src_image))
+            return
 
-        # vegetation height
         gdal.gdalwarp(
-            self.veg_height_image,
-            self.clipped_images['veg_height'],
+            src_image,
+            dst_image,
             target_crs,
             extents,
             self.cell_size,
-            resample=self.veg_height_resample,
+            resample=resample,
+            warp_memory=self.warp_memory,
+            num_threads=num_threads,
             logger=self._logger
         )
 
@@ -108,19 +159,70 @@ class BaseVegetation():
         """Load the clipped images from gdalwarp into a xr.Dataset
         """
 
-        # load into xarray dataset
+        # lazily load into xarray dataset, the images are read when the
+        # topo is written
         da = []
         for dataset, image in self.clipped_images.items():
-            da.append(rioxarray.open_rasterio(image, default_name=dataset))
-
-            if not self.debug:
-                os.remove(image)
+            da.append(rioxarray.open_rasterio(
+                image,
+                default_name=dataset,
+                chunks=raster.block_chunks(image, self.chunk_size)
+            ))
 
         da = [w.to_dataset() for w in da]
         self.ds = xr.combine_by_coords(da)
         self.ds = self.ds.squeeze('band')
         self.ds = self.ds.drop_vars('band')
 
+    def remove_clipped_images(self):
+        """Remove the clipped images once they are no longer being read
+        """
+
+        if not self.debug:
+            for image in self.clipped_images.values():
+                if os.path.isfile(image):
+                    os.remove(image)
+
+    @staticmethod
+    def class_lookup(image, values):
+        """Map an image of integer classes to values using a dense lookup
+        table. Works on both numpy and dask backed images.
+
+        Args:
+            image (xr.DataArray): image of integer classes
+            values (pd.Series): values indexed by the class
+
+        Returns:
+            xr.DataArray: image of values, NaN for classes not in values
+        """
+
+        values = values[values.index.notnull()]
+        classes = values.index.to_numpy().astype(np.intp)
+
+        # The table is offset by the smallest class as the no data
+        # value is negative. Keep the precision of the values.
+        class_min = classes.min()
+        lut = np.full(
+            classes.max() - class_min + 1,
+            np.nan,
+            dtype=np.result_type(values.dtype, np.float32)
+        )
+        lut[classes - class_min] = values.to_numpy()
+
+        def lookup(image_class):
+            idx = image_class.astype(np.intp) - class_min
+            outside = (idx < 0) | (idx >= len(lut))
+            result = lut[np.clip(idx, 0, len(lut) - 1)]
+            result[outside] = np.nan
+            return result
+
+        return xr.apply_ufunc(
+            lookup,
+            image,
+            dask='parallelized',
+            output_dtypes=[lut.dtype]
+        )
+
     def calculate_tau_and_k(self):
         """Populate an image of veg_tau and veg_k from the vegetation parameters
         csv file.
@@ -135,14 +237,11 @@ class BaseVegetation():
         veg_df = pd.read_csv(self.config['veg_params_csv'])
         veg_df.set_index(self.DATASET, inplace=True)
 
-        # create NaN filled DataArray's to populate
-        veg_tau = self.ds['veg_type'].copy() * np.NaN
-        veg_k = self.ds['veg_type'].copy() * np.NaN
-
-        # check for missing values
-        veg_types = np.unique(self.ds['veg_type'])
-        check = veg_df.loc[veg_types, 'tau']
-        missing = check[check.isnull()]
+        # check for missing values, the classes in the image are read once
+        # here so the lookups can't introduce NaN values
+        veg_types = np.asarray(np.unique(self.ds['veg_type'].data))
+        check = veg_df.loc[veg_types, ['tau', 'k']]
+        missing = check[check.isnull().any(axis=1)]
 
         if len(missing) > 0:
             raise ValueError(
@@ -150,14 +249,8 @@ class BaseVegetation():
                     list(missing.index)
                 ))
 
-        for veg_type in veg_types:
-            idx = self.ds['veg_type'].values == veg_type
-            veg_tau.values[idx] = veg_df.loc[veg_type, 'tau']
-            veg_k.values[idx] = veg_df.loc[veg_type, 'k']
-
-        # sanity check to make sure that there are no NaN values in the images
-        assert np.sum(np.isnan(veg_tau.values)) == 0
-        assert np.sum(np.isnan(veg_k.values)) == 0
+        veg_tau = self.class_lookup(self.ds['veg_type'], veg_df['tau'])
+        veg_k = self.class_lookup(self.ds['veg_type'], veg_df['k'])
 
         self.veg_tau_k = xr.combine_by_coords([
             self.ds['veg_type'].to_dataset(),
@@ -170,49 +263,50 @@ class BaseVegetation():
         self.veg_tau_k['veg_tau'].attrs = {'long_name': 'vegetation tau'}
         self.veg_tau_k['veg_k'].attrs = {'long_name': 'vegetation k'}
 
+    @cached_property
+    def class_heights(self):
+        """Parse the Landfire csv file for the height of each vegetation
+        height class, parsed once for the dataset.
+
+        Returns:
+            pd.Series: float32 height indexed by the class value
+        """
+
+        veg_csv = pd.read_csv(
+            self.veg_height_csv,
+            usecols=['VALUE', 'CLASSNAMES'],
+            index_col='VALUE'
+        )
+
+        # average all the numbers in each class name at once, the class
+        # names without a number are 0 (see assumption in calculate_height)
+        matches = veg_csv['CLASSNAMES'].str.extractall(HEIGHT_CLASS_REGEX)
+        heights = matches[0].astype(np.float64).groupby(level=0).mean()
+        heights = heights.reindex(veg_csv.index, fill_value=0)
+
+        return heights.astype(np.float32).rename('height')
+
     def calculate_height(self):
         """Parse the Landfire csv files for vegetation height
         """
 
         self._logger.debug('Calculating veg height')
 
-        veg_csv = pd.read_csv(self.veg_height_csv)
-        veg_csv.set_index('VALUE', inplace=True)
-
-        # match whole numbers and decimals in the line
-        regex = re.compile(r"(?<!\*)(\d*\.?\d+)(?!\*)")
-        veg_csv['height'] = 0.0  # see assumption below
-        for idx, row in veg_csv.iterrows():
-            matches = regex.findall(row.CLASSNAMES)
-            if len(matches) > 0:
-                veg_csv.loc[idx, 'height'] = np.mean(
-                    np.array([float(x) for x in matches])
-                )
-
-        # create an image that is full of 0 values. This makes the assumption
-        # that any value that is not found in the csv file will have a
-        # height of 0 meters. This will work most of the time except in
+        # create an image of the heights for each class. This makes the
+        # assumption that any value that is not found in the csv file will
+        # have a height of 0 meters. This will work most of the time except in
         # developed or agriculture but there isn't snow there anyways...
-        height = self.ds['veg_height'].astype(np.float64).copy() * 0
-        topo_veg_heights_class = np.unique(self.ds['veg_height'])
-
-        print_warning = 1
-        for veg_height_class in topo_veg_heights_class:
-            try:
-                idx = self.ds['veg_height'].values == veg_height_class
-                height.values[idx] = veg_csv.loc[veg_height_class, 'height']
-            except:
-                if print_warning:
-                    print('** WARNING **\n'
-                          '  An unknown vegetation height class was found. \n'
-                          '  This could be cause by using the wrong vegetation'
-                          'height resample algorithm.'
-                    )
-                    print_warning = 0
-
-
-        # sanity check
-        assert np.sum(np.isnan(height.values)) == 0
+        height = self.class_lookup(self.ds['veg_height'], self.class_heights)
+
+        # check the classes in the image instead of the whole height image
+        veg_heights = np.asarray(np.unique(self.ds['veg_height'].data))
+        if not np.isin(veg_heights, self.class_heights.index).all():
+            print('** WARNING **\n'
+                  '  An unknown vegetation height class was found. \n'
+                  '  This could be cause by using the wrong vegetation'
+                  'height resample algorithm.'
+                  )
+            height = height.fillna(0)
 
         self.veg_height = height
         self.veg_height.attrs = {'long_name': 'vegetation height'}
@@ -234,7 +328,7 @@ class BaseVegetation():
 
         images = []
         for image in self.VEG_IMAGES:
-            veg = dem.copy() * np.NaN
+            veg = xr.full_like(dem, np.nan, dtype=np.float32)
             veg.name = image
             images.append(veg.to_dataset())
 
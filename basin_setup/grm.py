@@ -4,23 +4,29 @@ import argparse
 import datetime
 import logging
 import os
+import re
 import shutil
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from subprocess import check_output
 
 import coloredlogs
 import netCDF4 as nc
 import numpy as np
 import pandas as pd
-from inicheck.utilities import mk_lst, remove_chars
+import rasterio
 from spatialnc.topo import get_topo_stats
-from spatialnc.utilities import copy_nc, mask_nc
+from spatialnc.utilities import copy_nc
 
 from basin_setup import __version__
 
 DEBUG = False
 
+NON_NUMERIC = re.compile(r'\D')
 
+
+@lru_cache(maxsize=None)
 def parse_fname_date(fname):
     """
     Attempts to parse the date from the filename using underscores. This
@@ -54,8 +60,8 @@ def parse_fname_date(fname):
 
     # Attempt to parse a date in the filename one at a time
     for w in bname:
-        # Grab only numbers and letters
-        dt_str = "".join([c for c in w if c.isnumeric()])
+        # Grab only numbers
+        dt_str = NON_NUMERIC.sub('', w)
 
         try:
             # Successful datestring found, break out
@@ -69,33 +75,39 @@ def parse_fname_date(fname):
     return dt
 
 
-def parse_gdalinfo(fname):
+def water_year(date):
     """
-    Executes gdalinfo from the commandline on fname. Returns a dictionary of
-    cell size, origin, and extents
+    Calculates the water year of a date, which starts on October 1st of the
+    previous year.
+
+    Args:
+        date: Datetime object
+
+    Return:
+        tuple: the water year and the year it starts in
     """
 
-    image_info = {}
-    info = check_output(["gdalinfo", fname], universal_newlines=True)
-    for line in info.split("\n"):
-        if "=" in line:
-            data = line.split("=")
-            data = [k.strip().lower() for k in data]
+    wy = date.year
 
-            # Keyword should always be first
-            if data[0] in ["pixel size", "origin"]:
+    if date.month >= 10:
+        wy += 1
 
-                result = []
+    return wy, wy - 1
 
-                if "," in data[1]:
-                    v = data[1].split(',')
-                else:
-                    v = [data[1]]
 
-                for s in v:
-                    result.append(float(remove_chars(s, "()\n:")))
+def parse_gdalinfo(fname):
+    """
+    Opens fname with rasterio and reads the geotransform. Returns a dictionary
+    of cell size and origin in the same form as gdalinfo reports them.
+    """
+
+    with rasterio.open(fname) as src:
+        transform = src.transform
 
-                image_info[data[0]] = mk_lst(result, unlst=True)
+    image_info = {
+        'pixel size': [transform.a, transform.e],
+        'origin': [transform.c, transform.f],
+    }
 
     return image_info
 
@@ -112,6 +124,10 @@ class GRM(object):
         if not hasattr(self, 'log'):
             self.log = logging.getLogger(__name__)
 
+        # Output netcdfs kept open by the caller across a batch of images
+        if not hasattr(self, 'output_datasets'):
+            self.output_datasets = None
+
         # Manage Logging
         level = "INFO"
 
@@ -167,27 +183,41 @@ class GRM(object):
                                 abs(int(self.ts['du']))))
 
         outfile, ext = outfile.split(".")
+
+        # Images with the same file name can be grid matched at the same
+        # time in a batch, keep their working files separate
+        if getattr(self, 'index', None) is not None:
+            outfile = "{}_{}".format(self.index, outfile)
+
         outfile = outfile + ".nc"
 
         outfile = os.path.join(self.temp, outfile)
 
         self.log.debug("Writing grid adjusted image to:\n{}".format(outfile))
+        x = self.ts['x']
+        y = self.ts['y']
+
+        # Threads for the warp, limited when images are grid matched in
+        # parallel so the workers don't each use all the CPUs
+        num_threads = getattr(self, 'num_threads', None) or 'ALL_CPUS'
+
         cmd = ["gdalwarp",
-               "-r {}".format(self.resample),
-               "-of NETCDF",
+               "-r", self.resample,
+               "-of", "NETCDF",
                "-overwrite",
-               "-srcnodata -9999",
-               "-dstnodata -9999",
-               "-te {} {} {} {}".format(int(np.min(self.ts["x"])),
-                                        int(np.min(self.ts["y"])),
-                                        int(np.max(self.ts["x"])),
-                                        int(np.max(self.ts["y"]))),
-               "-ts {} {}".format(self.ts['nx'], self.ts['ny']),
+               "-multi",
+               "-wo", "NUM_THREADS={}".format(num_threads),
+               "-wm", "512",
+               "-srcnodata", "-9999",
+               "-dstnodata", "-9999",
+               "-te", str(int(x.min())), str(int(y.min())),
+               str(int(x.max())), str(int(y.max())),
+               "-ts", str(self.ts['nx']), str(self.ts['ny']),
                self.image,
                outfile]
 
         self.log.debug("Executing: {}".format(" ".join(cmd)))
-        check_output(" ".join(cmd), shell=True)
+        check_output(cmd)
 
         self.working_file = outfile
 
@@ -219,10 +249,16 @@ class GRM(object):
             start_date)
         setattr(self.ds.variables['time'], 'calendar', 'standard')
 
-        # Add append a new image
+        # Add append a new image, one compressed chunk per flight for
+        # basin sized domains
         self.ds.createVariable("depth", "f", ("time", "y", "x"),
-                                        chunksizes=(6, 10, 10),
-                                        fill_value=np.nan)
+                               chunksizes=(1,
+                                           min(256, self.ts['ny']),
+                                           min(256, self.ts['nx'])),
+                               zlib=True,
+                               complevel=4,
+                               shuffle=True,
+                               fill_value=np.nan)
 
         self.ds['depth'].setncatts({
             "units": "meters",
@@ -270,12 +306,7 @@ class GRM(object):
             self.date = pd.to_datetime(self.date)
 
         # Calculate the start of the water year and the water year
-        self.water_year = self.date.year
-
-        if self.date.month <= 10:
-            self.start_yr = self.water_year - 1
-        else:
-            self.water_year += 1
+        self.water_year, self.start_yr = water_year(self.date)
 
         # output netcdf
         self.outfile = os.path.join(self.output, ("lidar_depths_wy{}.nc"
@@ -294,8 +325,13 @@ class GRM(object):
             self.log.info(
                 "Output NetCDF exists, checking to see if everything matches.")
 
-            # Retrieve existing dataset
-            self.ds = nc.Dataset(self.outfile, mode='a')
+            # Retrieve existing dataset, it may already be open for the batch
+            if self.output_datasets is not None and \
+                    self.outfile in self.output_datasets:
+                self.ds = self.output_datasets[self.outfile]
+            else:
+                self.ds = nc.Dataset(self.outfile, mode='a')
+                self.add_output_dataset()
 
             # Check for matching basins
             self.check_basin_match()
@@ -315,6 +351,7 @@ class GRM(object):
         # Create a netcdf
         else:
             self.create_lidar_netcdf()
+            self.add_output_dataset()
 
         # Calculate the time index
         index = self.get_time_index()
@@ -324,33 +361,45 @@ class GRM(object):
 
         # Open the newly convert depth and add it to the collection
         self.log.info("Extracting the new netcdf data...")
-        new_ds = nc.Dataset(self.working_file, mode='a')
+        new_ds = nc.Dataset(self.working_file, mode='r')
 
-        # Fill values to np.nan
-        idx = new_ds.variables['Band1'][:] == \
-            new_ds.variables['Band1']._FillValue
-        new_ds.variables['Band1'][:][idx] = np.nan
-
-        new_ds.variables['Band1'][:] = np.flipud(new_ds.variables['Band1'][:])
+        # Fill values to np.nan, netCDF4 masks the _FillValue on read. Flip
+        # the image with a view so it is only copied when masked.
+        depth = np.ma.filled(new_ds.variables['Band1'][:], np.nan)
+        depth = depth[::-1, :]
 
         new_ds.close()
 
-        # Mask it
+        # Mask it in memory with the topo mask
         self.log.info("Masking lidar data...")
-        new_ds = mask_nc(self.working_file, self.topo, output=self.temp)
+        mask = np.ma.filled(self.topo_ds.variables['mask'][:], 0)
+        depth = np.where(mask.astype(bool), depth, np.nan)
 
         # Save it to output
         self.log.info(
             "Adding masked lidar data to {}".format(
                 self.ds.filepath()))
 
-        self.ds.variables['depth'][index, :] = new_ds.variables['Band1'][:]
-        self.ds.sync()
+        self.ds.variables['depth'][index, :] = depth
+
+        # The caller closes the output when it is shared across a batch, so
+        # it is only opened once. Sync each image so an interrupted batch
+        # doesn't leave the file with the earlier flights unreadable.
+        if self.output_datasets is None:
+            self.ds.close()
+        else:
+            self.ds.sync()
 
-        self.ds.close()
-        new_ds.close()
         self.topo_ds.close()
 
+    def add_output_dataset(self):
+        """
+        Keeps the opened output netcdf with the batch of output datasets so
+        it is only opened once.
+        """
+        if self.output_datasets is not None:
+            self.output_datasets[self.outfile] = self.ds
+
     def get_time_index(self):
         """
         Calculates the time based index in hours for current image to go into
@@ -365,16 +414,15 @@ class GRM(object):
                         times.units,
                         times.calendar)
 
-        # Figure out the time index
-        if len(times) != 0:
-            index = np.where(times[:] == t)[0]
+        # Figure out the time index, the existing times are in the order the
+        # flights were added which isn't always chronological
+        ts = times[:]
+        match = np.flatnonzero(ts == t)
 
-            if index.size == 0:
-                index = len(times)
-            else:
-                index = index[0]
+        if len(match) > 0:
+            index = int(match[0])
         else:
-            index = len(times)
+            index = len(ts)
 
         self.log.info("Input data is {} hours from the beginning of the water"
                       " year.".format(int(t)))
@@ -395,12 +443,8 @@ class GRM(object):
         keywords = [w for w in topo_mask.split(" ") if w not in [
             'river', 'basin']]
 
-        for key in keywords:
-            if key in self.basin.lower():
-                found = True
-                break
-            else:
-                found = False
+        basin = self.basin.lower()
+        found = any(key in basin for key in keywords)
 
         self.handle_error("Topo's mask name matches the basin name.",
                           ("Topo's mask ({}) is not associated to the {}."
@@ -446,11 +490,13 @@ class GRM(object):
         """
 
         times = self.ds.variables['time']
-        ncdates = nc.num2date(times[:], times.units, calendar=times.calendar)
-        ncdates = np.array([pd.to_datetime(dt).date() for dt in ncdates])
+        ncdates = nc.num2date(times[:], times.units, calendar=times.calendar,
+                              only_use_cftime_datetimes=False,
+                              only_use_python_datetimes=True)
+        ncdates = np.asarray(ncdates).astype('datetime64[D]')
 
         # Is the incoming date already in the file?
-        error = self.date.date() in ncdates
+        error = bool(np.any(ncdates == np.datetime64(self.date.date())))
         errmsg = ("This image's date is already in the preexisting netcdf.")
         dbgmsg = ("Incoming date appears to be unique to the dataset.")
         self.handle_error(dbgmsg, errmsg, error=error)
@@ -466,36 +512,59 @@ class GRM(object):
         error = False
         dbgmsg = 'Topo domain and resolution matches the current lidar netCDF!'
 
-        # Check that domain extents are the same
+        # Check that domain extents are the same, read each axis once
         for v in ['x', 'y']:
-            for fn in [np.max, np.min]:
-                v_topo = fn(self.topo_ds.variables[v][:])
-                v_lidar = fn(self.ds.variables[v][:])
-
-                if v_topo != v_lidar:
-                    error = True
-                    dbgmsg = ("ERROR: Domain mismatch, Topo {0} {1} != Lidar NetCDF {0} {1}"  # noqa
-                              "".format(v, fn.__name__))
+            v_topo = self.topo_ds.variables[v][:]
+            v_lidar = self.ds.variables[v][:]
 
             # Check that the topo and the current lidar netcdf have the same
             # nx,ny
-            if len(self.topo_ds.variables[v][:]) != len(
-                    self.ds.variables[v][:]):
+            if len(v_topo) != len(v_lidar):
                 error = True
                 dbgmsg = ("ERROR Domain Mismatch: Topo n{0} != Lidar NetCDF n{0}"  # noqa
                           "".format(v))
+                break
+
+            for fn in ['max', 'min']:
+                if getattr(v_topo, fn)() != getattr(v_lidar, fn)():
+                    error = True
+                    dbgmsg = ("ERROR: Domain mismatch, Topo {0} {1} != Lidar NetCDF {0} {1}"  # noqa
+                              "".format(v, fn))
+                    break
+
+            if error:
+                break
 
         self.handle_error(dbgmsg, errmsg, error=error)
 
 
-def run_grm(**kwargs):
+def grid_match_image(**kwargs):
     '''
-    Run GRM for one image
+    Setup GRM for one image and match it to the topo grid. This is the
+    expensive part of GRM and is safe to run in a separate process.
     '''
     g = GRM(**kwargs)
     g.grid_match()
+    return g
+
+
+def add_grid_matched_image(future, log, output_datasets):
+    '''
+    Add an image grid matched in a worker process to the lidar collection.
+    The output netcdfs are opened once and shared through output_datasets.
+    '''
+    g = future.result()
+    g.log = log
+    g.output_datasets = output_datasets
+    g.add_to_collection()
+
+
+def run_grm(**kwargs):
+    '''
+    Run GRM for one image
+    '''
+    g = grid_match_image(**kwargs)
     g.add_to_collection()
-    # return g
 
 
 def main():
@@ -560,14 +629,9 @@ def main():
     # Make sure our output folder exists
     output = args.output
 
-    # Make the output folder
-    if not os.path.isdir(output):
-        os.mkdir(output)
-
-    # Make the temp folder inside the output folder
+    # Make the output folder and the temp folder inside the output folder
     temp = os.path.join(output, 'tmp')
-    if not os.path.isdir(temp):
-        os.mkdir(temp)
+    os.makedirs(temp, exist_ok=True)
 
     if not isinstance(args.images, list):
         args.images = [args.images]
@@ -601,32 +665,58 @@ def main():
     # Loop through all images provided
     log.info("Number of images being processed: {}".format(len(args.images)))
 
-    for d in sorted(image_dict.keys()):
-        f = image_dict[d]
-
-        log.info("")
-        log.info("Processing {}".format(os.path.basename(f)))
-
-        kwargs = {'image': f, 'topo': args.topo, 'basin': args.basin,
-                  'debug': args.debug,
-                  'output': output,
-                  'temp': temp,
-                  'resample': args.resample,
-                  'date': d,
-                  'log': log}
+    # Grid match the images in parallel, each worker writes to its own file in
+    # the temp folder. Adding to the collection happens here in date order.
+    # The CPUs are split between the workers for their warp threads.
+    cpu_count = os.cpu_count() or 1
+    max_workers = min(len(image_dict), cpu_count)
+    num_threads = max(1, cpu_count // max_workers)
+
+    # Output netcdfs by file name, each is opened once for all the images
+    output_datasets = {}
+
+    # Images in date order with their file names for logging
+    items = [(d, f, os.path.basename(f))
+             for d, f in sorted(image_dict.items())]
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for index, (d, f, _) in enumerate(items):
+                kwargs = {'image': f, 'topo': args.topo,
+                          'basin': args.basin,
+                          'debug': args.debug,
+                          'output': output,
+                          'temp': temp,
+                          'resample': args.resample,
+                          'date': d,
+                          'index': index,
+                          'num_threads': num_threads}
+                futures[d] = executor.submit(grid_match_image, **kwargs)
+
+            for d, f, name in items:
+                log.info("")
+                log.info("Processing {}".format(name))
+
+                if not DEBUG or args.allow_exceptions:
+                    try:
+                        add_grid_matched_image(
+                            futures[d], log, output_datasets)
+
+                    except Exception as e:
+                        log.warning(
+                            "Skipping {} due to error".format(name))
+                        log.error(e)
+                        skips += 1
 
-        if not DEBUG or args.allow_exceptions:
-            try:
-                run_grm(**kwargs)
-
-            except Exception as e:
-                log.warning("Skipping {} due to error".format(
-                    os.path.basename(f)))
-                log.error(e)
-                skips += 1
+                else:
+                    add_grid_matched_image(futures[d], log, output_datasets)
 
-        else:
-            run_grm(**kwargs)
+    finally:
+        # Close each output once all the images are added, the images
+        # that were added are kept if one fails
+        for ds in output_datasets.values():
+            ds.close()
 
     stop = time.time()
 
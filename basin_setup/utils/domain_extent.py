@@ -1,4 +1,7 @@
+import os
 import re
+from copy import deepcopy
+from functools import lru_cache
 from subprocess import check_output
 
 import netCDF4 as nc
@@ -21,6 +24,8 @@ def parse_from_file(fname, x_field='x', y_field='y'):
     asc reads the header
     netcdf uses nc.Dataset x_field and y_field
 
+    The parsed information is cached until the file is modified.
+
     Args:
         fname: Full path point to file containing GIS information
 
@@ -30,6 +35,33 @@ def parse_from_file(fname, x_field='x', y_field='y'):
         cellsize: cell size for the image
     """
 
+    try:
+        stat = os.stat(fname)
+        modified = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        # parsing will raise the error for the file
+        modified = None
+
+    extent, cellsize = _parse_from_file(fname, modified, x_field, y_field)
+
+    # copies so the callers can modify them without changing the cache
+    return deepcopy(extent), deepcopy(cellsize)
+
+
+@lru_cache(maxsize=128)
+def _parse_from_file(fname, modified, x_field, y_field):
+    """Parse the information of some GIS file, see `parse_from_file`
+
+    Args:
+        fname: Full path point to file containing GIS information
+        modified: file modification time and size to key the cache on
+        x_field: netcdf x variable name
+        y_field: netcdf y variable name
+
+    Returns:
+        tuple: extent and cell size for the image
+    """
+
     cellsize = None
 
     # regular expression to look for numbers within parenthisis
@@ -197,8 +229,12 @@ def condition_to_cellsize(extent, cell_size, logger=None):
 
 def affine_transform_from_extents(extents, cell_size):
 
-    x = np.arange(extents[0], extents[2], cell_size)
-    y = np.arange(extents[1], extents[3], cell_size)
+    # Count the cells first so floating point error in the extents can't
+    # add or drop a cell
+    nx = int(round((extents[2] - extents[0]) / cell_size))
+    ny = int(round((extents[3] - extents[1]) / cell_size))
+    x = extents[0] + np.arange(nx, dtype=np.float64) * cell_size
+    y = extents[1] + np.arange(ny, dtype=np.float64) * cell_size
     transform = rasterio.transform.from_bounds(
         extents[0],
         extents[1],
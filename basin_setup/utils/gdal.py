@@ -43,8 +43,10 @@ def call_subprocess(action, function_name, logger=None):
 
 
 def gdalwarp(src_image, dst_image, target_crs, extents,
-             cell_size, resample='bilinear', logger=None):
-    """gdalwarp to reproject, resample cell size and crop to extent
+             cell_size, resample='bilinear', warp_memory=None,
+             error_threshold=0.125, num_threads=None, logger=None):
+    """gdalwarp to reproject, resample cell size and crop to extent. The warp
+    is multi-threaded and uses the approximate transformer.
 
     Args:
         src_image (str): source DEM file
@@ -53,6 +55,13 @@ def gdalwarp(src_image, dst_image, target_crs, extents,
         extents (list): Extents to crop to [left, bottom, right, top]
         cell_size (float): cell size to resample to
         resample (str, optional): resampling method. Defaults to 'bilinear'.
+        warp_memory (str, optional): memory for the warp, in MB or a
+            percentage of the RAM i.e. 30%. Defaults to None, the GDAL default.
+        error_threshold (float, optional): error threshold in pixels for the
+            approximate transformer, 0 uses the exact transformer.
+            Defaults to 0.125.
+        num_threads (int, optional): threads for the warp. Defaults to None,
+            all the CPUs.
         logger (logging, optional): Log information to the logger if provided.
             Defaults to None.
 
@@ -60,7 +69,7 @@ def gdalwarp(src_image, dst_image, target_crs, extents,
         boolean: True if call to gdalwarp was successful
     """
 
-    cmd = "gdalwarp -t_srs {} -te {}, {}, {}, {} -tr {} {} -r {} -overwrite {} {}".format(  # noqa
+    cmd = "gdalwarp -t_srs {} -te {}, {}, {}, {} -tr {} {} -r {} -et {} -multi -wo NUM_THREADS={}".format(  # noqa
         target_crs,
         extents[0],
         extents[1],
@@ -69,10 +78,15 @@ def gdalwarp(src_image, dst_image, target_crs, extents,
         cell_size,
         cell_size,
         resample,
-        src_image,
-        dst_image
+        error_threshold,
+        num_threads or 'ALL_CPUS'
     )
 
+    if warp_memory is not None:
+        cmd += " -wm {}".format(warp_memory)
+
+    cmd += " -overwrite {} {}".format(src_image, dst_image)
+
     if logger is not None:
         logger.debug(cmd)
 
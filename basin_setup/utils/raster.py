@@ -0,0 +1,159 @@
+import numpy as np
+import rasterio
+from rasterio import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+
+def block_chunks(image, chunk_size):
+    """Dask chunks for lazily reading an image that are aligned to the
+    blocks of the image on disk. Each chunk is the largest multiple of the
+    block size that fits within the chunk size, and at least one block.
+
+    Args:
+        image (str): path to the raster image
+        chunk_size (int): number of cells in x and y for each chunk
+
+    Returns:
+        dict: chunks for the y and x dimensions
+    """
+
+    with rasterio.open(image) as src:
+        block_y, block_x = src.block_shapes[0]
+
+    return {
+        'y': max(block_y, chunk_size // block_y * block_y),
+        'x': max(block_x, chunk_size // block_x * block_x)
+    }
+
+
+def aligned_window(image, target_crs, extents, cell_size):
+    """Find the window of an image that the target grid lines up with. The
+    image has to be in the target CRS, the target cell size a whole multiple
+    of the image cell size and the target extents on the image grid and
+    within the image.
+
+    Args:
+        image (str): path to the raster image
+        target_crs (str): EPSG code, i.e. EPSG:32611
+        extents (list): Extents to crop to [left, bottom, right, top]
+        cell_size (float): target cell size
+
+    Returns:
+        tuple: the image window and the number of image cells in each target
+            cell, None if the grids do not line up
+    """
+
+    def whole(value):
+        return abs(value - round(value)) < 1e-6
+
+    try:
+        src = rasterio.open(image)
+    except rasterio.errors.RasterioIOError:
+        return None
+
+    with src:
+        transform = src.transform
+        if src.crs is None or src.crs != CRS.from_user_input(target_crs) or \
+                not transform.is_rectilinear or transform.a != -transform.e:
+            return None
+
+        # position and size of the target grid in image cells
+        factor = cell_size / transform.a
+        col, row = ~transform * (extents[0], extents[3])
+        nx = (extents[2] - extents[0]) / cell_size
+        ny = (extents[3] - extents[1]) / cell_size
+
+        if not all(whole(v) for v in [factor, col, row, nx, ny]):
+            return None
+
+        factor, col, row, nx, ny = [
+            int(round(v)) for v in [factor, col, row, nx, ny]]
+
+        if factor < 1 or col < 0 or row < 0 or \
+                col + nx * factor > src.width or \
+                row + ny * factor > src.height:
+            return None
+
+    return Window(col, row, nx * factor, ny * factor), factor
+
+
+def block_mode(src_image, dst_image, target_crs, extents, cell_size):
+    """Coarsen an image of classes to the cell size with the most common
+    class in each block of cells, ignoring no data. Ties go to the class
+    that reaches the count first in scan order, the same as gdalwarp. This
+    is only possible when the image is already in the target CRS and the
+    target grid lines up with the image grid at a whole multiple of the
+    image cell size, otherwise the image needs to be warped.
+
+    Args:
+        src_image (str): source image of classes
+        dst_image (str): destination file for the coarsened image
+        target_crs (str): EPSG code, i.e. EPSG:32611
+        extents (list): Extents to crop to [left, bottom, right, top]
+        cell_size (float): cell size to coarsen to
+
+    Returns:
+        boolean: True if the image was coarsened, False if the grids do not
+            line up
+    """
+
+    aligned = aligned_window(src_image, target_crs, extents, cell_size)
+    if aligned is None:
+        return False
+
+    window, factor = aligned
+    nx = int(window.width) // factor
+    ny = int(window.height) // factor
+
+    with rasterio.open(src_image) as src:
+        data = src.read(1, window=window)
+        dtype = src.dtypes[0]
+        nodata = src.nodata
+        crs = src.crs
+
+    # the cells in each target cell along the last axis
+    blocks = data.reshape(ny, factor, nx, factor).swapaxes(1, 2)
+    blocks = blocks.reshape(ny, nx, factor * factor)
+
+    # Sort the cells in each block, the count of a class is the length of
+    # its run. The running count within each run peaks at the end of the
+    # run. The stable sort keeps each run in scan order, so the end of the
+    # run is the last cell of the class in the block.
+    order = np.argsort(blocks, axis=-1, kind='stable')
+    blocks = np.take_along_axis(blocks, order, axis=-1)
+    position = np.arange(blocks.shape[-1])
+    run_start = np.ones(blocks.shape, dtype=bool)
+    run_start[..., 1:] = blocks[..., 1:] != blocks[..., :-1]
+    count = position - np.maximum.accumulate(
+        np.where(run_start, position, 0), axis=-1) + 1
+
+    if nodata is not None:
+        count[blocks == nodata] = 0
+
+    # Like gdalwarp, a tie goes to the class that reaches the count first
+    # in scan order, which is the class with the earliest last cell
+    max_count = count.max(axis=-1, keepdims=True)
+    peak = np.where(count == max_count, order, order.shape[-1]).argmin(
+        axis=-1)[..., None]
+    mode = np.take_along_axis(blocks, peak, axis=-1)[..., 0]
+
+    # blocks with only no data
+    if nodata is not None:
+        mode[max_count[..., 0] == 0] = nodata
+
+    with rasterio.open(
+        dst_image,
+        'w',
+        driver='GTiff',
+        width=nx,
+        height=ny,
+        count=1,
+        dtype=dtype,
+        crs=crs,
+        transform=Affine(cell_size, 0, extents[0], 0, -cell_size, extents[3]),
+        nodata=nodata
+    ) as dst:
+        dst.write(mode, 1)
+
+    return True
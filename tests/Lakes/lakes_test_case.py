@@ -23,6 +23,9 @@ class BasinSetupLakes(unittest.TestCase):
     config_file = os.path.join(basin_dir, BASE_INI_FILE_NAME)
     output_topo = os.path.join(basin_dir, 'output', 'topo.nc')
 
+    # Number of rows along the first dimension compared at a time
+    COMPARE_ROWS = 128
+
     @classmethod
     def base_config_copy(cls):
         return deepcopy(cls._base_config)
@@ -103,35 +106,43 @@ class BasinSetupLakes(unittest.TestCase):
         """
         Compare two netcdf files to ensure that they are identical. The
         tests will compare the attributes of each variable and ensure that
-        the values are exact
+        the values are exact. The values are compared `COMPARE_ROWS` along
+        the first dimension at a time to limit the memory used.
         """
 
         gold = nc.Dataset(self.gold_dir.joinpath(gold_file))
         test = nc.Dataset(self.output_dir.joinpath(output_file))
 
-        # go through all variables and compare everything including
-        # the attributes and data
-        for var_name, v in gold.variables.items():
-
-            # compare the dimensions
-            for att in gold.variables[var_name].ncattrs():
-                if att == '_FillValue':
-                    self.assertTrue(
-                        np.isnan(getattr(test.variables[var_name], att)))
-                else:
-                    self.assertEqual(
-                        getattr(gold.variables[var_name], att),
-                        getattr(test.variables[var_name], att))
-
-            # only compare those that are floats
-            if gold.variables[var_name].datatype != np.dtype('S1'):
+        try:
+            # go through all variables and compare everything including
+            # the attributes and data
+            for var_name, v in gold.variables.items():
+                test_v = test.variables[var_name]
+
+                # compare the dimensions
+                for att in v.ncattrs():
+                    if att == '_FillValue':
+                        self.assertTrue(np.isnan(getattr(test_v, att)))
+                    else:
+                        self.assertEqual(
+                            getattr(v, att), getattr(test_v, att))
+
+                # only compare those that are floats
+                if v.datatype == np.dtype('S1'):
+                    continue
+
                 error_msg = "Variable: {0} did not match gold standard". \
                     format(var_name)
-                self.assert_gold_equal(
-                    gold.variables[var_name][:],
-                    test.variables[var_name][:],
-                    error_msg
-                )
 
-        gold.close()
-        test.close()
+                if v.ndim == 0:
+                    self.assert_gold_equal(v[:], test_v[:], error_msg)
+                    continue
+
+                self.assertEqual(v.shape, test_v.shape, error_msg)
+                for start in range(0, v.shape[0], self.COMPARE_ROWS):
+                    rows = slice(start, start + self.COMPARE_ROWS)
+                    self.assert_gold_equal(v[rows], test_v[rows], error_msg)
+
+        finally:
+            gold.close()
+            test.close()
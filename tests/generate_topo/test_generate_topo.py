@@ -1,6 +1,10 @@
+import os
+import threading
 from unittest.mock import patch
 
 import numpy as np
+import rasterio
+import rasterio.windows
 import xarray as xr
 from inicheck.config import UserConfig
 from numpy import testing as np_test
@@ -35,7 +39,8 @@ class TestBasinSetup(BasinSetupLakes):
         super().setUpClass()
 
     def setUp(self) -> None:
-        self.subject = GenerateTopo(config_file=self.config_file)
+        # the config is parsed once for the class, each test gets a copy
+        self.subject = GenerateTopo(config_file=self.base_config_copy())
 
     def test_init(self):
         self.assertIsInstance(self.subject.ucfg, UserConfig)
@@ -49,8 +54,14 @@ class TestBasinSetup(BasinSetupLakes):
         self.assertIsInstance(self.subject.transform, Affine)
         self.assertTrue(len(self.subject.x) == 58)
         self.assertTrue(len(self.subject.y) == 62)
+        self.assertEqual(self.subject.x.dtype, np.float64)
+        self.assertEqual(self.subject.y.dtype, np.float64)
+        cell_size = self.subject.cell_size
+        np_test.assert_allclose(np.diff(self.subject.x), cell_size)
+        np_test.assert_allclose(np.diff(self.subject.y), cell_size)
 
     def test_load_basin_shapefiles(self):
+        self.subject.extents = self.EXTENTS
         self.subject.load_basin_shapefiles()
 
         self.assertTrue(len(self.subject.basin_shapefiles) == 1)
@@ -74,6 +85,59 @@ class TestBasinSetup(BasinSetupLakes):
         self.assertCountEqual(list(self.subject.dem.coords.keys()), [
                               'y', 'x', 'spatial_ref'])
 
+    def test_load_dem_in_memory(self):
+        clipped_dem = os.path.join(self.subject.temp_dir, 'clipped_dem.tif')
+        if os.path.isfile(clipped_dem):
+            os.remove(clipped_dem)
+
+        self.subject.config['warp_in_memory'] = True
+        self.subject.crs = self.CRS
+        self.subject.extents = self.EXTENTS
+        self.subject.load_dem()
+
+        self.assertFalse(os.path.isfile(clipped_dem))
+        self.assertIsInstance(self.subject.dem, xr.DataArray)
+        self.assertCountEqual(list(self.subject.dem.coords.keys()), [
+                              'y', 'x', 'spatial_ref'])
+        np_test.assert_allclose(
+            self.subject.dem.rio.bounds(), self.EXTENTS_RASTER, atol=1e-3)
+        self.assertEqual(
+            self.subject.dem.rio.resolution(),
+            (self.subject.cell_size, -self.subject.cell_size)
+        )
+
+    @patch.object(gdal, 'gdalwarp', return_value=True)
+    def test_load_dem_aligned(self, mock_warp):
+        # The DEM grid at the DEM cell size only needs a crop
+        extents = [319520.405027, 4158537.07547, 328520.405027, 4166537.07547]
+        self.subject.crs = self.CRS
+        self.subject.extents = extents
+        self.subject.cell_size = 100
+        self.subject.load_dem()
+
+        self.assertFalse(mock_warp.called)
+        self.assertEqual(self.subject.dem.shape, (80, 90))
+        np_test.assert_allclose(self.subject.dem.rio.bounds(), extents)
+
+        with rasterio.open(self.subject.config['dem_file']) as src:
+            window = rasterio.windows.from_bounds(
+                *extents, transform=src.transform)
+            np_test.assert_array_equal(
+                self.subject.dem.values, src.read(1, window=window))
+
+    def test_load_dem_block_chunks(self):
+        self.subject.crs = self.CRS
+        self.subject.extents = self.EXTENTS
+        # smaller than a block to read one block per chunk
+        self.subject.chunk_size = 1
+        self.subject.load_dem()
+
+        with rasterio.open(self.subject.images['dem']) as src:
+            block_y, block_x = src.block_shapes[0]
+
+        self.assertEqual(self.subject.dem.chunks[0][0], block_y)
+        self.assertEqual(self.subject.dem.chunks[1][0], block_x)
+
     @patch.object(Landfire140, 'reproject', return_value=True)
     def test_load_vegetation(self, mock_veg):
         self.subject.crs = self.CRS
@@ -106,7 +170,7 @@ class TestBasinSetup(BasinSetupLakes):
         )
         # Keep heights as float data type for sub-meter classification
         self.assertTrue(
-            self.subject.veg.veg_height.dtype == np.float64
+            self.subject.veg.veg_height.dtype == np.float32
         )
 
     @patch.object(gdal, 'gdalwarp', return_value=True)
@@ -116,16 +180,23 @@ class TestBasinSetup(BasinSetupLakes):
         self.subject.load_vegetation()
 
         self.assertEqual(mock_veg.call_count, 2)
-        # Call 1 to vegetation type
+        # The warps run at the same time, find the calls by source image
+        calls = {call[1][0]: call[2] for call in mock_veg.mock_calls}
+        # Call to vegetation type
         self.assertEqual(
-            mock_veg.mock_calls[0][2]['resample'],
+            calls[self.subject.veg.veg_type_image]['resample'],
             'mode'
         )
-        # Call 2 to vegetation height
+        # Call to vegetation height
         self.assertEqual(
-            mock_veg.mock_calls[1][2]['resample'],
+            calls[self.subject.veg.veg_height_image]['resample'],
             'mode'
         )
+        # Both calls use the configured warp memory and split the CPUs
+        for call in mock_veg.mock_calls:
+            self.assertEqual(call[2]['warp_memory'], '512')
+            self.assertEqual(
+                call[2]['num_threads'], max(1, (os.cpu_count() or 1) // 2))
 
     @patch.object(gdal, 'gdalwarp', return_value=True)
     def test_vegetation_resample_method_custom(self, mock_veg):
@@ -139,20 +210,50 @@ class TestBasinSetup(BasinSetupLakes):
         self.subject.load_vegetation()
 
         self.assertEqual(mock_veg.call_count, 2)
-        # Call 1 to vegetation type
+        # The warps run at the same time, find the calls by source image
+        calls = {call[1][0]: call[2] for call in mock_veg.mock_calls}
+        # Call to vegetation type
         self.assertEqual(
-            mock_veg.mock_calls[0][2]['resample'],
+            calls[self.subject.veg.veg_type_image]['resample'],
             nearest_neighbor_resample
         )
-        # Call 2 to vegetation height
+        # Call to vegetation height
         self.assertEqual(
-            mock_veg.mock_calls[1][2]['resample'],
+            calls[self.subject.veg.veg_height_image]['resample'],
             nearest_neighbor_resample
         )
+        # Both calls use the configured warp memory
+        for call in mock_veg.mock_calls:
+            self.assertEqual(call[2]['warp_memory'], '512')
+
+    @patch.object(GenerateTopo, 'remove_intermediate_files')
+    @patch.object(GenerateTopo, 'create_netcdf')
+    @patch.object(GenerateTopo, 'load_vegetation')
+    @patch.object(GenerateTopo, 'load_dem')
+    @patch.object(GenerateTopo, 'load_basin_shapefiles')
+    @patch.object(GenerateTopo, 'set_extents')
+    def test_run_parallel(self, _mock_extents, _mock_shapefiles, mock_dem,
+                          mock_veg, mock_netcdf, _mock_rm):
+        self.assertTrue(self.subject.config['parallel_load'])
+
+        # Both loads wait for each other, this only passes when they run
+        # at the same time
+        barrier = threading.Barrier(2, timeout=10)
+        mock_dem.side_effect = barrier.wait
+        mock_veg.side_effect = barrier.wait
+        self.subject.run()
+
+        mock_dem.assert_called_once()
+        mock_veg.assert_called_once()
+        mock_netcdf.assert_called_once()
+
+        # The CPUs are split between the DEM and vegetation warps
+        self.assertEqual(
+            self.subject.num_threads, max(1, (os.cpu_count() or 1) // 3))
 
     @patch.object(Landfire140, 'reproject', return_value=True)
     def test_run(self, _mock_veg):
-        gt = GenerateTopo(config_file=self.config_file)
+        gt = GenerateTopo(config_file=self.base_config_copy())
         gt.run()
 
         ds = xr.open_dataset(self.output_topo, cache=False)
@@ -166,6 +267,13 @@ class TestBasinSetup(BasinSetupLakes):
             ['dem', 'mask', 'veg_height', 'veg_k',
                 'veg_tau', 'veg_type', 'projection']
         )
+
+        # All images share the same chunks
+        chunksizes = (min(128, ds.sizes['y']), min(128, ds.sizes['x']))
+        for name in ['dem', 'mask', 'veg_height', 'veg_k',
+                     'veg_tau', 'veg_type']:
+            self.assertEqual(ds[name].encoding['chunksizes'], chunksizes)
+            self.assertFalse(ds[name].encoding['zlib'])
         ds.close()
 
         self.compare_netcdf_files('landfire_140/topo.nc', 'topo.nc')
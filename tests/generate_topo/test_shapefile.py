@@ -1,4 +1,6 @@
 import numpy as np
+import pyproj
+from shapely import ops
 
 from basin_setup.generate_topo.shapefile import Shapefile
 from basin_setup.utils import domain_extent
@@ -20,9 +22,40 @@ class TestShapefile(BasinSetupLakes):
         self.assertIsInstance(self.shape, Shapefile)
         self.assertTrue(len(self.shape.polygon) == 1)
 
+    def test_load_bbox(self):
+        shape = Shapefile(
+            'tests/Lakes/gold/basin_outline.shp', bbox=tuple(self.EXTENTS))
+        self.assertTrue(len(shape.polygon) == 1)
+
+        # the basin is outside of the box
+        shape = Shapefile(
+            'tests/Lakes/gold/basin_outline.shp', bbox=(0, 0, 1000, 1000))
+        self.assertTrue(len(shape.polygon) == 0)
+
     def test_crs(self):
         self.assertEqual(self.shape.crs, self.CRS)
 
+    def test_crs_cached(self):
+        self.assertIs(self.shape.crs, self.shape.crs)
+
+    def test_reproject(self):
+        shape = Shapefile('tests/Lakes/gold/basin_outline.shp')
+        transformer = pyproj.Transformer.from_crs(
+            shape.crs, 'EPSG:4326', always_xy=True)
+        expected = [
+            ops.transform(transformer.transform, geometry)
+            for geometry in shape.polygon.geometry
+        ]
+
+        shape.reproject('EPSG:4326')
+        self.assertEqual(shape.crs.lower(), 'epsg:4326')
+        for geometry, expected_geometry in zip(
+                shape.polygon.geometry, expected):
+            np.testing.assert_allclose(
+                np.array(geometry.exterior.coords),
+                np.array(expected_geometry.exterior.coords)
+            )
+
     def test_mask(self):
         transform, x, y = domain_extent.affine_transform_from_extents(
             self.EXTENTS, self.CELL_SIZE)
@@ -1,9 +1,14 @@
 import os
 from unittest.mock import patch
 
+import numpy as np
+import pandas as pd
 import xarray as xr
+from rasterio.io import DatasetReader
 
 from basin_setup.generate_topo.vegetation import Landfire140
+from basin_setup.generate_topo.vegetation.base_vegetation import \
+    HEIGHT_CLASS_REGEX
 from basin_setup.utils import domain_extent
 from tests.Lakes.lakes_test_case import BasinSetupLakes
 
@@ -50,6 +55,8 @@ class TestLandfire140(BasinSetupLakes):
     def test_load_clipped_images(self):
         self.subject.load_clipped_images()
         self.assertIsInstance(self.subject.ds, xr.Dataset)
+        # images are lazily loaded with dask
+        self.assertIsNotNone(self.subject.ds['veg_type'].chunks)
 
     def test_calculate_tau_and_k(self):
         self.subject.load_clipped_images()
@@ -72,3 +79,76 @@ class TestLandfire140(BasinSetupLakes):
             list(self.subject.veg_height.coords.keys()),
             ['y', 'x', 'spatial_ref']
         )
+
+    def test_calculate_reads_images_once(self):
+        self.subject.load_clipped_images()
+
+        read = DatasetReader.read
+        reads = []
+
+        def count_read(dataset, *args, **kwargs):
+            reads.append(dataset.name)
+            return read(dataset, *args, **kwargs)
+
+        with patch.object(DatasetReader, 'read', count_read):
+            self.subject.calculate_tau_and_k()
+            self.subject.calculate_height()
+
+        # one read of each image for the classes in it, the rest is lazy
+        self.assertCountEqual(
+            reads, list(self.subject.clipped_images.values()))
+        self.assertIsNotNone(self.subject.veg_tau_k['veg_tau'].chunks)
+        self.assertIsNotNone(self.subject.veg_height.chunks)
+
+    def test_calculate_height_unknown_class(self):
+        self.subject.load_clipped_images()
+        class_heights = self.subject.class_heights
+        self.subject.class_heights = class_heights.iloc[1:]
+
+        try:
+            self.subject.calculate_height()
+        finally:
+            self.subject.class_heights = class_heights
+
+        self.assertFalse(self.subject.veg_height.isnull().any())
+
+    def test_calculate_height_float32(self):
+        self.subject.load_clipped_images()
+        self.subject.calculate_height()
+        self.assertEqual(self.subject.veg_height.dtype, np.float32)
+
+        # float64 heights from the class names for the same classes
+        veg_csv = pd.read_csv(self.subject.veg_height_csv, index_col='VALUE')
+        heights = veg_csv['CLASSNAMES'].map(
+            lambda name: np.mean(
+                [float(v) for v in HEIGHT_CLASS_REGEX.findall(name)] or [0.0]
+            )
+        )
+        classes = self.subject.ds['veg_height'].values
+        expected = heights.reindex(classes.ravel()).fillna(0).to_numpy()
+
+        np.testing.assert_allclose(
+            self.subject.veg_height.values.ravel(), expected, atol=0.1)
+
+    def test_class_lookup(self):
+        values = pd.Series(
+            [0.5, 1.5, 25.0, 7.25],
+            index=pd.Index([11, 12, 101, 250], name='VALUE')
+        )
+        reference = dict(values.items())
+        classes = np.array([
+            [11, 12, 101, 250],
+            [250, 101, -9999, 42],
+        ], dtype=np.int16)
+
+        image = xr.DataArray(classes, dims=('y', 'x'))
+        result = Landfire140.class_lookup(image, values)
+
+        expected = [
+            [reference.get(int(c), np.nan) for c in row] for row in classes
+        ]
+        np.testing.assert_array_equal(result.values, expected)
+
+        # the same for a dask backed image
+        result = Landfire140.class_lookup(image.chunk({'x': 2}), values)
+        np.testing.assert_array_equal(result.values, expected)
@@ -25,7 +25,7 @@ class TestVegetationOptions(BasinSetupLakes):
 
     @patch.object(Landfire140, 'reproject', return_value=True)
     def test_landfire_140(self, mock_reproject):
-        gt = GenerateTopo(config_file=self.config_file)
+        gt = GenerateTopo(config_file=self.base_config_copy())
         gt.run()
         self.assertTrue(mock_reproject.called)
         self.assertTrue(mock_reproject.call_count == 1)
@@ -77,7 +77,7 @@ class TestVegetationOptions(BasinSetupLakes):
 
     @patch.object(Landfire140, 'reproject', return_value=True)
     def test_no_veg(self, mock_reproject):
-        gt = GenerateTopo(config_file=self.config_file)
+        gt = GenerateTopo(config_file=self.base_config_copy())
         gt.config['vegetation_dataset'] = None
         gt.run()
 
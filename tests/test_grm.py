@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import logging
 import os
 import shutil
 import unittest
 from subprocess import check_output
+from unittest.mock import patch
 
+import netCDF4 as nc
 import numpy as np
 import pandas as pd
 
-from basin_setup.grm import parse_fname_date
+from basin_setup.grm import GRM, parse_fname_date, water_year
 
 from .basin_setup_test_case import BSTestCase
 
@@ -81,6 +84,11 @@ class TestGRM(unittest.TestCase):
     Tests for running the test class
     '''
 
+    def setUp(self):
+        # keep the logging out of handlers left on the root logger
+        self.log = logging.getLogger('{}.TestGRM'.format(__name__))
+        self.log.propagate = False
+
     def test_parse_fname_date(self):
         """
         Test the parsing of dates
@@ -106,3 +114,79 @@ class TestGRM(unittest.TestCase):
         for p in not_parseable:
             dt = parse_fname_date(p)
             assert dt is None
+
+    def test_water_year(self):
+        """
+        Test the water year starts on October 1st
+        """
+
+        dates = {
+            '2019-09-30': (2019, 2018),
+            '2019-10-01': (2020, 2019),
+            '2019-12-15': (2020, 2019),
+        }
+
+        for date, expected in dates.items():
+            self.assertEqual(water_year(pd.to_datetime(date)), expected)
+
+    def test_get_time_index(self):
+        """
+        Test the time index when the flights were not added in order
+        """
+
+        g = GRM.__new__(GRM)
+        g.log = self.log
+        g.ds = nc.Dataset('time_index.nc', mode='w', diskless=True)
+
+        try:
+            g.ds.createDimension('time', None)
+            times = g.ds.createVariable('time', 'f', ('time',))
+            times.units = 'hours since 2018-10-01 00:00:00'
+            times.calendar = 'standard'
+            times[:] = [5111, 4223]
+
+            # existing flight
+            g.date = pd.to_datetime('2019-03-25')
+            self.assertEqual(g.get_time_index(), 1)
+
+            # new flight
+            g.date = pd.to_datetime('2019-04-01')
+            self.assertEqual(g.get_time_index(), 2)
+            self.assertEqual(list(times[:]), [5111, 4223, 4391])
+
+        finally:
+            g.ds.close()
+
+    @patch('basin_setup.grm.check_output')
+    def test_grid_match_working_file(self, mock_check_output):
+        """
+        Test images with the same file name get their own working file
+        """
+
+        lakes = os.path.join(os.path.dirname(__file__), 'Lakes')
+        kwargs = {
+            'image': os.path.join(
+                lakes, 'data', 'USCALB20190325_test_100m.tif'),
+            'topo': os.path.join(lakes, 'gold', 'landfire_140', 'topo.nc'),
+            'basin': 'lakes',
+            'temp': 'tmp',
+            'resample': 'bilinear',
+            'num_threads': 2,
+            'log': self.log
+        }
+
+        working_files = []
+        for index in range(2):
+            g = GRM(index=index, **kwargs)
+            g.grid_match()
+            working_files.append(g.working_file)
+
+        self.assertEqual(
+            working_files,
+            [os.path.join('tmp', '0_USCALB20190325_test_100m.nc'),
+             os.path.join('tmp', '1_USCALB20190325_test_100m.nc')]
+        )
+
+        cmd = mock_check_output.call_args[0][0]
+        self.assertIn('NUM_THREADS=2', cmd)
+        self.assertEqual(cmd[-1], working_files[-1])
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+import netCDF4 as nc
+import numpy as np
+
+from tests.Lakes.lakes_test_case import BasinSetupLakes
+
+
+class TestCompareNetcdfFiles(BasinSetupLakes):
+
+    NY = 2048
+    NX = 512
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.gold_file = os.path.join(cls.temp_dir.name, 'gold.nc')
+        cls.test_file = os.path.join(cls.temp_dir.name, 'test.nc')
+
+        data = np.random.default_rng(0).random((cls.NY, cls.NX))
+        for file_name in [cls.gold_file, cls.test_file]:
+            with nc.Dataset(file_name, 'w') as ds:
+                ds.createDimension('y', cls.NY)
+                ds.createDimension('x', cls.NX)
+                ds.createVariable('dem', 'f8', ('y', 'x'))
+                ds.variables['dem'][:] = data
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_compare_memory(self):
+        tracemalloc.start()
+        try:
+            self.compare_netcdf_files(self.gold_file, self.test_file)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Only a window of rows from each file is read at a time
+        self.assertLess(peak, self.NY * self.NX * 8)
+
+    def test_compare_mismatch(self):
+        test_file = os.path.join(self.temp_dir.name, 'mismatch.nc')
+        shutil.copyfile(self.test_file, test_file)
+        with nc.Dataset(test_file, 'a') as ds:
+            ds.variables['dem'][-1, -1] = -1
+
+        with self.assertRaises(AssertionError):
+            self.compare_netcdf_files(self.gold_file, test_file)
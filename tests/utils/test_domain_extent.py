@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+from unittest.mock import patch
 
 from basin_setup.utils import domain_extent
 from tests.Lakes.lakes_test_case import BasinSetupLakes
@@ -40,6 +43,47 @@ class TestParseFromFile(BasinSetupLakes):
         )
         self.assertIsNone(cellsize)
 
+    def test_cached(self):
+        file_name = os.path.join(
+            self.basin_dir, 'data', 'dem_epsg_32611_100m.tif')
+        domain_extent._parse_from_file.cache_clear()
+
+        with patch.object(domain_extent, 'check_output',
+                          wraps=domain_extent.check_output) as mock_info:
+            extents, cellsize = domain_extent.parse_from_file(file_name)
+
+            # modifying the result does not change the cache
+            extents[0] -= 1000
+            cached, cached_cellsize = domain_extent.parse_from_file(
+                file_name)
+
+            self.assertEqual(mock_info.call_count, 1)
+            self.assertListEqual(
+                cached,
+                [318520.405, 4157537.075, 329820.405, 4167937.075]
+            )
+            self.assertTrue(cached_cellsize == 100)
+
+    def test_cached_modified(self):
+        source = os.path.join(
+            self.basin_dir, 'data', 'dem_epsg_32611_100m.tif')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, 'dem.tif')
+            shutil.copyfile(source, file_name)
+
+            with patch.object(domain_extent, 'check_output',
+                              wraps=domain_extent.check_output) as mock_info:
+                domain_extent.parse_from_file(file_name)
+                stat = os.stat(file_name)
+                os.utime(
+                    file_name,
+                    ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000)
+                )
+                domain_extent.parse_from_file(file_name)
+
+                self.assertEqual(mock_info.call_count, 2)
+
 
 class TestConditionToCellsize(BasinSetupLakes):
 
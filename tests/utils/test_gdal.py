@@ -0,0 +1,36 @@
+import unittest
+from unittest.mock import patch
+
+from basin_setup.utils import gdal
+
+
+@patch.object(gdal, 'call_subprocess', return_value=True)
+class TestGdalwarp(unittest.TestCase):
+    EXTENTS = [319570.405, 4157787.075, 328270.405, 4167087.075]
+
+    def gdalwarp(self, **kwargs):
+        return gdal.gdalwarp(
+            'src.tif', 'dst.tif', 'EPSG:32611', self.EXTENTS, 150, **kwargs
+        )
+
+    def test_default(self, mock_call):
+        self.assertTrue(self.gdalwarp())
+
+        cmd = mock_call.call_args[0][0].split()
+        self.assertEqual(cmd[0], 'gdalwarp')
+        self.assertEqual(cmd[-2:], ['src.tif', 'dst.tif'])
+        self.assertIn('-multi', cmd)
+        self.assertIn('NUM_THREADS=ALL_CPUS', cmd)
+        self.assertEqual(cmd[cmd.index('-r') + 1], 'bilinear')
+        self.assertEqual(cmd[cmd.index('-et') + 1], '0.125')
+        self.assertNotIn('-wm', cmd)
+
+    def test_custom(self, mock_call):
+        self.gdalwarp(resample='mode', warp_memory='30%', error_threshold=0,
+                      num_threads=2)
+
+        cmd = mock_call.call_args[0][0].split()
+        self.assertEqual(cmd[cmd.index('-r') + 1], 'mode')
+        self.assertEqual(cmd[cmd.index('-wm') + 1], '30%')
+        self.assertEqual(cmd[cmd.index('-et') + 1], '0')
+        self.assertIn('NUM_THREADS=2', cmd)
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import rasterio
+from rasterio import Affine
+from rasterio.warp import Resampling, reproject
+
+from basin_setup.utils import raster
+
+
+class TestBlockMode(unittest.TestCase):
+
+    CRS = 'EPSG:32611'
+    NODATA = -9999
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.src_image = os.path.join(cls.temp_dir.name, 'classes.tif')
+        cls.dst_image = os.path.join(cls.temp_dir.name, 'coarse.tif')
+
+        # 6x9 cells of 30m, the top left at 300, 600
+        cls.data = np.array([
+            [1, 1, 2, 5, 5, 5, 7, 8, 9],
+            [1, 2, 2, 5, 6, 6, 7, 8, 9],
+            [3, 3, 2, 6, 6, 6, 9, 8, 7],
+            [4, 4, 4, -9999, -9999, -9999, -9999, -9999, 2],
+            [4, 1, 1, -9999, -9999, -9999, -9999, -9999, -9999],
+            [4, 1, 1, -9999, -9999, -9999, -9999, -9999, -9999],
+        ], dtype=np.int16)
+
+        with rasterio.open(
+            cls.src_image, 'w', driver='GTiff', width=9, height=6, count=1,
+            dtype='int16', crs=cls.CRS, nodata=cls.NODATA,
+            transform=Affine(30, 0, 300, 0, -30, 600)
+        ) as dst:
+            dst.write(cls.data, 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def test_block_mode(self):
+        self.assertTrue(raster.block_mode(
+            self.src_image, self.dst_image, self.CRS,
+            [300, 420, 570, 600], 90))
+
+        with rasterio.open(self.dst_image) as src:
+            self.assertEqual(src.transform, Affine(90, 0, 300, 0, -90, 600))
+            self.assertEqual(src.nodata, self.NODATA)
+            mode = src.read(1)
+
+        # ties go to the class that reaches the count first, 9 of 7/8/9,
+        # and no data is ignored
+        np.testing.assert_array_equal(
+            mode,
+            [[2, 6, 9],
+             [4, -9999, 2]]
+        )
+
+    def test_block_mode_matches_warp(self):
+        # few classes so most blocks have ties, with some no data
+        rng = np.random.default_rng(0)
+        src_image = os.path.join(self.temp_dir.name, 'ties.tif')
+
+        for factor in [2, 3, 4]:
+            data = rng.integers(1, 5, size=(12 * factor, 12 * factor))
+            data[rng.random(data.shape) < 0.1] = self.NODATA
+            data = data.astype(np.int16)
+            transform = Affine(30, 0, 300, 0, -30, 600)
+
+            with rasterio.open(
+                src_image, 'w', driver='GTiff', width=data.shape[1],
+                height=data.shape[0], count=1, dtype='int16', crs=self.CRS,
+                nodata=self.NODATA, transform=transform
+            ) as dst:
+                dst.write(data, 1)
+
+            cell_size = 30 * factor
+            self.assertTrue(raster.block_mode(
+                src_image, self.dst_image, self.CRS,
+                [300, 600 - 12 * cell_size, 300 + 12 * cell_size, 600],
+                cell_size))
+
+            with rasterio.open(self.dst_image) as src:
+                mode = src.read(1)
+
+            warped = np.full((12, 12), self.NODATA, dtype=np.int16)
+            reproject(
+                data,
+                warped,
+                src_transform=transform,
+                src_crs=self.CRS,
+                src_nodata=self.NODATA,
+                dst_transform=Affine(cell_size, 0, 300, 0, -cell_size, 600),
+                dst_crs=self.CRS,
+                dst_nodata=self.NODATA,
+                resampling=Resampling.mode
+            )
+
+            np.testing.assert_array_equal(mode, warped)
+
+    def test_block_mode_subset(self):
+        self.assertTrue(raster.block_mode(
+            self.src_image, self.dst_image, self.CRS,
+            [390, 510, 480, 600], 90))
+
+        with rasterio.open(self.dst_image) as src:
+            np.testing.assert_array_equal(src.read(1), [[6]])
+
+    def test_block_mode_not_aligned(self):
+        # different CRS
+        self.assertFalse(raster.block_mode(
+            self.src_image, self.dst_image, 'EPSG:32612',
+            [300, 420, 570, 600], 90))
+        # cell size is not a multiple
+        self.assertFalse(raster.block_mode(
+            self.src_image, self.dst_image, self.CRS,
+            [300, 420, 570, 600], 45))
+        # origin is not on the grid
+        self.assertFalse(raster.block_mode(
+            self.src_image, self.dst_image, self.CRS,
+            [310, 430, 580, 610], 90))
+        # outside the image
+        self.assertFalse(raster.block_mode(
+            self.src_image, self.dst_image, self.CRS,
+            [300, 330, 570, 600], 90))
+        # missing image
+        self.assertFalse(raster.block_mode(
+            'missing.tif', self.dst_image, self.CRS,
+            [300, 420, 570, 600], 90))